@@ -0,0 +1,237 @@
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future
+import atexit
+import queue
+import threading
+import time
+import weakref
+
+
+_fetchers = weakref.WeakSet()
+
+
+@atexit.register
+def _cancel_prefetches():
+    for fetcher in list(_fetchers):
+        fetcher.cancel()
+
+
+def _work(fetcher_ref, jobs):
+    # Holds the fetcher weakly so idle workers do not keep it alive; a finalizer sends None to stop them
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        fetcher = fetcher_ref()
+        if fetcher is None:
+            return
+        fetcher._run_queued(*job)
+        del fetcher
+
+
+def _stop_workers(jobs, workers):
+    for _ in range(workers):
+        jobs.put(None)
+
+
+class RateLimiter:
+    """Shares a transfer budget of max_bytes_per_second across threads."""
+
+    def __init__(self, max_bytes_per_second):
+        self.rate = max_bytes_per_second
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def consume(self, n):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + n / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ArtifactFetcher:
+    """Reads remote build artifacts through a LinusBox, sharing transfers between callers.
+
+    Concurrent fetches of the same path wait on a single transfer. prefetch queues paths to be read in the
+    background by at most max_workers daemon threads, throttled to max_bytes_per_second overall. A fetch of a path
+    that is still queued takes the transfer over and runs it immediately without the throttle. Prefetched data is
+    held in an LRU cache of up to max_cache_bytes until it is fetched once; foreground reads are not cached.
+    Each thread reads over its own SFTP session from linus.open_sftp(). Queued prefetches are cancelled at
+    interpreter exit.
+
+    GMSModel.fetcher is built from the FETCH_* settings in gmstk.defaults (overridable in gmstk.config), and may
+    be replaced with another ArtifactFetcher."""
+
+    def __init__(self, linus, max_workers=4, max_bytes_per_second=None, max_cache_bytes=2**28,
+                 block_size=2**20):
+        self.linus = linus
+        self.max_workers = max_workers
+        self.max_cache_bytes = max_cache_bytes
+        self.block_size = block_size
+        self._limiter = RateLimiter(max_bytes_per_second) if max_bytes_per_second else None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._in_flight = {}
+        self._queued = set()
+        self._jobs = queue.Queue()
+        self._workers = 0
+        weakref.finalize(self, _stop_workers, self._jobs, max_workers)
+        _fetchers.add(self)
+
+    def __contains__(self, path):
+        with self._lock:
+            return path in self._cache
+
+    def _claim(self, path, foreground):
+        """Returns (data, future, owner). owner is True if the caller must run (foreground) or queue the transfer."""
+        with self._lock:
+            if path in self._cache:
+                data = self._cache.pop(path) if foreground else self._cache[path]
+                if foreground:
+                    self._cache_bytes -= len(data)
+                return data, None, False
+            future = self._in_flight.get(path)
+            if future is not None and not future.cancelled():
+                if not (foreground and path in self._queued):
+                    return None, future, False
+                # Take over a prefetch that has not started yet
+                self._queued.discard(path)
+                if future.set_running_or_notify_cancel():
+                    return None, future, True
+            self._queued.discard(path)
+            future = Future()
+            self._in_flight[path] = future
+            if foreground:
+                future.set_running_or_notify_cancel()
+            else:
+                self._queued.add(path)
+            return None, future, True
+
+    def _session(self):
+        sftp = getattr(self._local, 'sftp', None)
+        if sftp is None:
+            sftp = self._local.sftp = self.linus.open_sftp()
+        return sftp
+
+    def _read(self, path, limiter=None):
+        if not path.startswith('/'):
+            path = '/'.join([self.linus.pwd().strip('"\''), path])
+        parts = []
+        try:
+            with self._session().open(path, 'r') as f:
+                while True:
+                    block = f.read(self.block_size)
+                    if not block:
+                        break
+                    if limiter is not None:
+                        limiter.consume(len(block))
+                    parts.append(block)
+        except BaseException:
+            # The session may be broken (e.g. after a reconnect or an interrupted read); open a new one next time
+            self._local.sftp = None
+            raise
+        return b''.join(parts)
+
+    def _release(self, path, future):
+        if self._in_flight.get(path) is future:
+            del self._in_flight[path]
+
+    def _transfer(self, path, future, limiter=None, store=False):
+        try:
+            data = self._read(path, limiter)
+        except BaseException as e:
+            with self._lock:
+                self._release(path, future)
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                return
+            # KeyboardInterrupt and similar: waiters see a cancelled transfer, the caller sees the interrupt
+            future.set_exception(CancelledError('Transfer of {0} was interrupted'.format(path)))
+            raise
+        with self._lock:
+            self._release(path, future)
+            if store:
+                self._store(path, data)
+        future.set_result(data)
+
+    def _store(self, path, data):
+        if len(data) > self.max_cache_bytes:
+            return
+        self._cache[path] = data
+        self._cache_bytes += len(data)
+        while self._cache_bytes > self.max_cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= len(evicted)
+
+    def _run_queued(self, path, future):
+        with self._lock:
+            # Skip transfers that were taken over by fetch or cancelled while queued
+            if self._in_flight.get(path) is not future or path not in self._queued:
+                return
+            self._queued.discard(path)
+            if not future.set_running_or_notify_cancel():
+                self._release(path, future)
+                return
+        self._transfer(path, future, self._limiter, store=True)
+
+    def fetch(self, path):
+        """Returns the contents of the remote path as bytes."""
+        if path is None:
+            raise TypeError('Expected a remote path, got None')
+        data, future, owner = self._claim(path, foreground=True)
+        if data is not None:
+            return data
+        if owner:
+            self._transfer(path, future)
+            return future.result()
+        data = future.result()
+        # Joined a running prefetch, which caches its result; this fetch is its one use
+        with self._lock:
+            if self._cache.get(path) is data:
+                del self._cache[path]
+                self._cache_bytes -= len(data)
+        return data
+
+    def prefetch(self, paths):
+        """Queues paths expected to be fetched soon.
+
+        Returns futures for the newly queued transfers; cancelling one drops it if it has not started."""
+        queued = []
+        for path in paths:
+            if path is None:
+                continue
+            data, future, owner = self._claim(path, foreground=False)
+            if not owner:
+                continue
+            self._jobs.put((path, future))
+            queued.append(future)
+        with self._lock:
+            while self._workers < min(self.max_workers, len(self._queued)):
+                threading.Thread(target=_work, args=(weakref.ref(self), self._jobs), daemon=True).start()
+                self._workers += 1
+        return queued
+
+    def cancel(self, paths=None):
+        """Cancels queued prefetches of paths (default: all) that have not started. Returns the number cancelled."""
+        cancelled = 0
+        with self._lock:
+            for path in list(self._queued if paths is None else self._queued.intersection(paths)):
+                self._queued.discard(path)
+                future = self._in_flight.pop(path)
+                cancelled += future.cancel()
+        return cancelled
+
+    def discard(self, path):
+        with self._lock:
+            data = self._cache.pop(path, None)
+            if data is not None:
+                self._cache_bytes -= len(data)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._cache_bytes = 0
@@ -5,4 +5,9 @@ USERNAME = ''
 HOSTNAME = ''
 PORT = 22
 KNOWN_HOSTS = HOME / ".ssh" / "known_hosts"
-CONFIG_PATH = Path(__file__).with_name('config.py')
\ No newline at end of file
+CONFIG_PATH = Path(__file__).with_name('config.py')
+
+# Background prefetching of build artifacts (GMSModel.fetcher); set FETCH_MAX_BYTES_PER_SECOND = None for no cap
+FETCH_MAX_WORKERS = 4
+FETCH_MAX_BYTES_PER_SECOND = 32 * 2**20
+FETCH_MAX_CACHE_BYTES = 256 * 2**20
@@ -118,6 +118,13 @@ class LinusBox:
         remote_file = self._sftp_client.open(filename)
         return remote_file
 
+    def open_sftp(self):
+        """Returns a new SFTP session over the existing connection, for use from a thread other than the caller of
+        open/ftp_get/ftp_put. Relative paths resolve against the remote home directory, not pwd()."""
+        if not self._connected:
+            self.connect()
+        return self._client.open_sftp()
+
     def cd(self, directory=''):
         directory = directory.strip('\'"')
         if directory == '':
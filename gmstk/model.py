@@ -1,4 +1,5 @@
 from gmstk.linusbox import *
+from gmstk.artifacts import ArtifactFetcher
 from collections import defaultdict
 import xml.etree.ElementTree as ET
 import logging
@@ -8,6 +9,8 @@ class GMSModel:
 
     linus = LinusBox()
     linus.connect()
+    fetcher = ArtifactFetcher(linus, max_workers=FETCH_MAX_WORKERS, max_bytes_per_second=FETCH_MAX_BYTES_PER_SECOND,
+                              max_cache_bytes=FETCH_MAX_CACHE_BYTES)
 
     gms_type = 'model'
 
@@ -1,5 +1,9 @@
 from gmstk.model import GMSModel, GMSModelGroup
+from gmstk import stats
+import numpy as np
 import pandas as pd
+import io
+import re
 from collections import Counter
 import warnings
 
@@ -34,12 +38,24 @@ class RNAModel(GMSModel):
     def gene_fpkm_df(self):
         if self._gene_fpkm_df is None:
             try:
-                with RNAModel.linus.open(self.gene_fpkm_path, 'r') as f:
-                    self._gene_fpkm_df = pd.read_csv(f, delimiter='\t')
+                data = RNAModel.fetcher.fetch(self.gene_fpkm_path)
+                self._gene_fpkm_df = pd.read_csv(io.BytesIO(data), delimiter='\t')
             except TypeError:
                 return None
         return self._gene_fpkm_df
 
+    def get_fpkm_values(self, tracking_ids=None):
+        """Returns FPKM values as an array ordered by tracking_ids (default: file order).
+
+        Raises ValueError if the build does not report exactly the given tracking_ids."""
+        df = self.gene_fpkm_df
+        if tracking_ids is None or np.array_equal(df['tracking_id'].values, tracking_ids):
+            return df['FPKM'].values
+        fpkm = df.set_index('tracking_id')['FPKM']
+        if not fpkm.index.is_unique or len(fpkm) != len(tracking_ids) or not fpkm.index.isin(tracking_ids).all():
+            raise ValueError('Genes reported by model {0} do not match the reference genes'.format(self.model_id))
+        return fpkm.reindex(tracking_ids).values
+
     def get_gene_fpkm(self, ensembl_id=None, gene_symbol=None):
         if ensembl_id is not None:
             v = self.gene_fpkm_df.loc[self.gene_fpkm_df['tracking_id'] == ensembl_id, 'FPKM'].values[0]
@@ -116,8 +132,74 @@ class RNAModelGroup(GMSModelGroup, RNAModel):
             data[model_id] = model.attributes().to_dict()
         return pd.DataFrame.from_dict(data, orient='index')
 
-    def get_differential_expression_models(self):
-        pass
+    def _resolve_models(self, models):
+        return [self.models[x] if isinstance(x, str) else x for x in models]
+
+    def get_fpkm_matrix(self, models=None, tracking_ids=None):
+        """Returns (genes x models) FPKM array with rows ordered by tracking_ids. Accepts models or model ids.
+
+        tracking_ids defaults to the gene order of the first model; see RNAModel.get_fpkm_values."""
+        if models is None:
+            models = self.models.values()
+        models = self._resolve_models(models)
+        if tracking_ids is None:
+            tracking_ids = models[0].gene_fpkm_df['tracking_id'].values
+        return np.column_stack([model.get_fpkm_values(tracking_ids) for model in models])
+
+    def prefetch(self, models=None):
+        """Warms the shared fetcher with the gene FPKM files of models (default: all models) in the background."""
+        if models is None:
+            models = self.models.values()
+        models = self._resolve_models(models)
+        return RNAModel.fetcher.prefetch(model.gene_fpkm_path for model in models if model._gene_fpkm_df is None)
+
+    def gene_fpkm_summary(self, models=None, chunk_size=1, threshold=1.0, **kwargs):
+        """Streams FPKM values model by model into a stats.CohortSummary without keeping every gene_fpkm_df loaded.
+
+        Models are read chunk_size at a time and aligned on the first model's tracking_ids; any gene_fpkm_df not
+        already cached is released after use.
+        Summaries from separate workers over disjoint models can be combined with CohortSummary.merge."""
+        if models is None:
+            models = self.models.values()
+        models = self._resolve_models(models)
+        if not models:
+            raise ValueError('Expected at least one model to summarize')
+        summary = None
+        for i in range(0, len(models), chunk_size):
+            chunk = models[i:i + chunk_size]
+            self.prefetch(models[i + chunk_size:i + 2 * chunk_size])
+            columns = []
+            for model in chunk:
+                cached = model._gene_fpkm_df is not None
+                if summary is None:
+                    summary = stats.CohortSummary(len(model.gene_fpkm_df), threshold=threshold,
+                                                  index=model.gene_fpkm_df['tracking_id'].values, **kwargs)
+                columns.append(model.get_fpkm_values(summary.index))
+                if not cached:
+                    model._gene_fpkm_df = None
+            summary.update(np.column_stack(columns))
+        return summary
+
+    def differential_expression(self, condition_1, condition_2, test='welch', pseudocount=1.0):
+        """Compares two lists of models (or model ids), e.g. values from split_models_on_field.
+
+        test is 'welch' or 'rank_sum'. Fold change is reported as condition_2 over condition_1."""
+        condition_1 = self._resolve_models(condition_1)
+        condition_2 = self._resolve_models(condition_2)
+        genes = condition_1[0].gene_fpkm_df[['gene_short_name', 'tracking_id']].reset_index(drop=True)
+        tracking_ids = genes['tracking_id'].values
+        df = stats.differential_expression(self.get_fpkm_matrix(condition_1, tracking_ids),
+                                           self.get_fpkm_matrix(condition_2, tracking_ids),
+                                           test=test, pseudocount=pseudocount)
+        return pd.concat([genes, df], axis=1)
+
+    def get_differential_expression_models(self, model_group_id):
+        """Returns the differential-expression models in GMS model group model_group_id that use models of this group.
+
+        DE models are not members of RNA-seq model groups, so the DE model group is given explicitly. A DE model is
+        kept if its input_model_ids include at least one model of this group."""
+        group = DifferentialExpressionModelGroup(model_group_id)
+        return group.select_input_models(self.model_labels)
 
 
 class DifferentialExpressionModel(GMSModel):
@@ -126,5 +208,66 @@ class DifferentialExpressionModel(GMSModel):
     show_values = {
         'id': 'id',
         'processing_profile': 'processing_profile.id',
-        'condition_pairs': 'condition_pairs'
+        'condition_pairs': 'condition_pairs',
+        'last_build_id': 'last_succeeded_build.id',
+        'last_build_path': 'last_succeeded_build.data_directory'
+    }
+    gene_diff_file = 'gene_exp.diff'
+    gene_diff_columns = {
+        'gene_id': 'tracking_id',
+        'gene': 'gene_short_name',
+        'value_1': 'mean_1',
+        'value_2': 'mean_2',
+        'log2(fold_change)': 'log2_fold_change'
     }
+
+    def __init__(self, model_id, update_on_init=True, *args, **kwargs):
+        super().__init__(model_id, *args, **kwargs)
+        self._gene_diff_df = None
+        if update_on_init:
+            self.update()
+
+    @property
+    def input_model_ids(self):
+        """Ids of the RNA-seq models named in condition_pairs"""
+        return set(re.findall(r'\b[0-9a-f]{32}\b', getattr(self, 'condition_pairs', None) or ''))
+
+    @property
+    def gene_diff_path(self):
+        try:
+            out = '/'.join((self.last_build_path, self.gene_diff_file))
+        except AttributeError:
+            out = None
+        return out
+
+    @property
+    def gene_diff_df(self):
+        """cuffdiff gene results from the last build, with columns named as in RNAModelGroup.differential_expression"""
+        if self._gene_diff_df is None:
+            try:
+                data = DifferentialExpressionModel.fetcher.fetch(self.gene_diff_path)
+                df = pd.read_csv(io.BytesIO(data), delimiter='\t')
+            except TypeError:
+                return None
+            self._gene_diff_df = df.rename(columns=self.gene_diff_columns)
+        return self._gene_diff_df
+
+
+class DifferentialExpressionModelGroup(GMSModelGroup, DifferentialExpressionModel):
+
+    def __init__(self, model_id, update_models_on_init=True, *args, **kwargs):
+        GMSModelGroup.__init__(self, model_id, *args, **kwargs)
+        self.filter_values = {'model_groups.id': self.model_id}
+        self.update(update_models=update_models_on_init)
+
+    def select_input_models(self, model_ids):
+        """Keeps only DE models whose input_model_ids include at least one of model_ids. Returns self."""
+        model_ids = set(model_ids)
+        self.models = {k: v for k, v in self.models.items() if v.input_model_ids & model_ids}
+        return self
+
+    def attributes(self):
+        data = dict()
+        for model_id, model in self.models.items():
+            data[model_id] = {x: getattr(model, x, None) for x in self.show_values}
+        return pd.DataFrame.from_dict(data, orient='index')
@@ -18,5 +18,5 @@ setup(name='gmstk',
       ],
       keywords='gms toolkit',
       packages=['gmstk'],
-      install_requires=['paramiko', 'pandas']
+      install_requires=['paramiko', 'pandas', 'numpy', 'scipy']
       )
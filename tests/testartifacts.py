@@ -0,0 +1,196 @@
+from gmstk.artifacts import ArtifactFetcher
+from concurrent.futures import ThreadPoolExecutor, wait
+import gc
+import io
+import os
+import subprocess
+import sys
+import threading
+import time
+import weakref
+
+
+class FakeSFTPFile(io.BytesIO):
+
+    def __init__(self, data, session):
+        super().__init__(data)
+        self.session = session
+
+    def close(self):
+        if not self.closed:
+            self.session.busy.release()
+        super().close()
+
+
+class FakeSFTPSession:
+    """Like a paramiko SFTPClient, fails if used from two threads at once"""
+
+    def __init__(self, box):
+        self.box = box
+        self.busy = threading.Lock()
+
+    def open(self, filename, mode='r'):
+        if not self.busy.acquire(blocking=False):
+            raise RuntimeError('SFTP session used from two threads at once')
+        try:
+            with self.box.lock:
+                self.box.opened.append(filename)
+                interrupt = filename in self.box.interrupt
+                self.box.interrupt.discard(filename)
+            time.sleep(self.box.delay)
+            if interrupt:
+                raise KeyboardInterrupt
+            return FakeSFTPFile(self.box.files[filename], self)
+        except BaseException:
+            self.busy.release()
+            raise
+
+
+class FakeLinusBox:
+
+    def __init__(self, files, delay=0.1):
+        self.files = files
+        self.delay = delay
+        self.opened = []
+        self.sessions = []
+        self.interrupt = set()
+        self.lock = threading.Lock()
+
+    def pwd(self):
+        return '/home'
+
+    def open_sftp(self):
+        session = FakeSFTPSession(self)
+        with self.lock:
+            self.sessions.append(session)
+        return session
+
+
+class TestArtifactFetcher:
+
+    @classmethod
+    def setup_class(cls):
+        cls.files = {'/build/{0}/genes.fpkm_tracking'.format(i): bytes([i]) * 1000 for i in range(10)}
+
+    def a_concurrent_fetches_share_transfer_test(self):
+        linus = FakeLinusBox(self.files)
+        fetcher = ArtifactFetcher(linus)
+        path = '/build/0/genes.fpkm_tracking'
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(fetcher.fetch, [path] * 8))
+        assert all(r == self.files[path] for r in results)
+        assert linus.opened == [path]
+        assert path not in fetcher
+
+    def b_prefetch_warms_cache_test(self):
+        linus = FakeLinusBox(self.files, delay=0.01)
+        fetcher = ArtifactFetcher(linus, max_workers=2, max_bytes_per_second=10**5)
+        wait(fetcher.prefetch(sorted(self.files)))
+        assert sorted(linus.opened) == sorted(self.files)
+        for path, data in self.files.items():
+            assert path in fetcher
+            assert fetcher.fetch(path) == data
+            assert path not in fetcher
+        assert len(linus.opened) == len(self.files)
+
+    def c_cache_is_bounded_test(self):
+        linus = FakeLinusBox(self.files, delay=0)
+        fetcher = ArtifactFetcher(linus, max_workers=1, max_cache_bytes=3000)
+        wait(fetcher.prefetch(sorted(self.files)))
+        assert sum(path in fetcher for path in self.files) == 3
+        fetcher.discard('/build/9/genes.fpkm_tracking')
+        assert '/build/9/genes.fpkm_tracking' not in fetcher
+
+    def d_failed_transfer_is_retried_test(self):
+        linus = FakeLinusBox(self.files, delay=0)
+        fetcher = ArtifactFetcher(linus)
+        try:
+            fetcher.fetch('/build/missing')
+        except KeyError:
+            pass
+        else:
+            assert False, 'Expected KeyError'
+        linus.files = dict(self.files, **{'/build/missing': b'found'})
+        assert fetcher.fetch('/build/missing') == b'found'
+
+    def e_fetch_jumps_prefetch_queue_test(self):
+        files = {'/build/{0}/genes.fpkm_tracking'.format(i): b'x' * 100 for i in range(40)}
+        linus = FakeLinusBox(files, delay=0.1)
+        fetcher = ArtifactFetcher(linus, max_workers=2, max_bytes_per_second=10**3)
+        paths = sorted(files)
+        futures = fetcher.prefetch(paths)
+        start = time.time()
+        assert fetcher.fetch(paths[-1]) == files[paths[-1]]
+        assert time.time() - start < 0.5
+        assert futures[-1].result(timeout=0) == files[paths[-1]]
+        assert fetcher.cancel() >= 30
+        assert all(f.cancelled() for f in futures[5:-1])
+        time.sleep(0.3)
+        assert len(linus.opened) < 10
+
+    def f_pending_prefetches_do_not_block_exit_test(self):
+        script = '\n'.join([
+            'import io, time',
+            'from gmstk.artifacts import ArtifactFetcher',
+            'class Box:',
+            '    def open_sftp(self):',
+            '        return self',
+            '    def open(self, filename, mode="r"):',
+            '        time.sleep(0.5)',
+            '        return io.BytesIO(b"x")',
+            'ArtifactFetcher(Box(), max_workers=2).prefetch(["/build/{0}".format(i) for i in range(200)])',
+        ])
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        start = time.time()
+        subprocess.run([sys.executable, '-c', script], cwd=root, check=True, timeout=30)
+        assert time.time() - start < 5
+
+    def g_sessions_are_per_thread_test(self):
+        linus = FakeLinusBox(self.files, delay=0.02)
+        fetcher = ArtifactFetcher(linus, max_workers=4)
+        paths = sorted(self.files)
+        futures = fetcher.prefetch(paths[:5])
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(fetcher.fetch, paths * 2))
+        wait(futures)
+        assert all(f.exception() is None for f in futures)
+        assert results == [self.files[p] for p in paths * 2]
+        assert len(linus.sessions) > 1
+
+    def h_relative_paths_resolve_against_pwd_test(self):
+        linus = FakeLinusBox({'/home/a.txt': b'a'}, delay=0)
+        assert ArtifactFetcher(linus).fetch('a.txt') == b'a'
+
+    def i_interrupted_fetch_is_released_test(self):
+        linus = FakeLinusBox(self.files, delay=0)
+        fetcher = ArtifactFetcher(linus)
+        path = '/build/0/genes.fpkm_tracking'
+        linus.interrupt.add(path)
+        try:
+            fetcher.fetch(path)
+        except KeyboardInterrupt:
+            pass
+        else:
+            assert False, 'Expected KeyboardInterrupt'
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            assert executor.submit(fetcher.fetch, path).result(timeout=2) == self.files[path]
+
+    def j_fetch_joining_running_prefetch_is_not_cached_test(self):
+        linus = FakeLinusBox(self.files, delay=0.2)
+        fetcher = ArtifactFetcher(linus, max_workers=1)
+        path = '/build/0/genes.fpkm_tracking'
+        futures = fetcher.prefetch([path])
+        time.sleep(0.05)
+        assert fetcher.fetch(path) == self.files[path]
+        assert futures[0].result() == self.files[path]
+        assert path not in fetcher
+        assert linus.opened == [path]
+
+    def k_fetcher_can_be_collected_test(self):
+        linus = FakeLinusBox(self.files, delay=0)
+        fetcher = ArtifactFetcher(linus, max_workers=2)
+        wait(fetcher.prefetch(sorted(self.files)))
+        ref = weakref.ref(fetcher)
+        del fetcher
+        gc.collect()
+        assert ref() is None
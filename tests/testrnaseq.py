@@ -1,5 +1,6 @@
-from gmstk.rnaseq import RNAModel, RNAModelGroup
+from gmstk.rnaseq import RNAModel, RNAModelGroup, DifferentialExpressionModel, DifferentialExpressionModelGroup
 import pandas as pd
+import os
 
 
 class TestRNASeq:
@@ -95,7 +96,91 @@ class TestRNASeq:
         assert isinstance(df, pd.DataFrame)
         assert df.shape == (3, 18)
 
+    def k_gene_fpkm_summary_test(self):
+        summary = self.model_group.gene_fpkm_summary(chunk_size=4)
+        assert summary.n == len(self.model_group)
+        assert list(summary.index) == list(self.model.gene_fpkm_df['tracking_id'])
+        try:
+            self.model_group.gene_fpkm_summary(models=[])
+        except ValueError:
+            pass
+        else:
+            assert False, 'Expected ValueError'
+
 
 class TestDifferentialExpression:
 
-    pass
+    @classmethod
+    def setup_class(cls):
+        cls.model_group = RNAModelGroup('34ec706e075d4335ab9bd83392e79d66')
+        cls.conditions = cls.model_group.split_models_on_field('subject_common_name', True)
+        cls.linus = DifferentialExpressionModel.linus
+        cls.build_dir = '/'.join([cls.linus.pwd().strip('"\''), 'gmstk_test_de_build'])
+        cls.linus.mkdir('-p', cls.build_dir)
+        local = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'gene_exp.diff')
+        cls.linus.ftp_put(local, '/'.join([cls.build_dir, 'gene_exp.diff']))
+
+    @classmethod
+    def teardown_class(cls):
+        cls.linus.rm('-rf', cls.build_dir)
+
+    def a_differential_expression_df_test(self):
+        df = self.model_group.differential_expression(self.conditions['tumor'], self.conditions['relapse'])
+        assert isinstance(df, pd.DataFrame)
+        assert df.shape[0] == self.model_group.gene_fpkm_df.shape[0]
+        assert set(['log2_fold_change', 'p_value', 'q_value']) <= set(df.columns)
+
+    def b_rank_sum_differential_expression_test(self):
+        df = self.model_group.differential_expression(self.conditions['tumor'], self.conditions['relapse'],
+                                                      test='rank_sum')
+        assert (df['q_value'].dropna() >= df['p_value'].dropna()).all()
+
+    def c_differential_expression_misaligned_genes_test(self):
+        model = self.model_group.models[self.conditions['tumor'][0]].copy()
+        model._gene_fpkm_df = self.model_group.models[model.model_id].gene_fpkm_df.iloc[::-1]
+        reordered = self.model_group.differential_expression([model] + self.conditions['tumor'][1:],
+                                                             self.conditions['relapse'])
+        expected = self.model_group.differential_expression(self.conditions['tumor'], self.conditions['relapse'])
+        assert reordered['p_value'].equals(expected['p_value'])
+        model._gene_fpkm_df = model._gene_fpkm_df.iloc[1:]
+        try:
+            self.model_group.differential_expression([model] + self.conditions['tumor'][1:],
+                                                     self.conditions['relapse'])
+        except ValueError:
+            pass
+        else:
+            assert False, 'Expected ValueError'
+
+    def d_gene_diff_df_from_build_test(self):
+        model = DifferentialExpressionModel('gmstk_test_de_model', update_on_init=False)
+        model.last_build_path = self.build_dir
+        model.condition_pairs = '{0} tumor {1} relapse'.format(self.conditions['tumor'][0],
+                                                               self.conditions['relapse'][0])
+        assert model.input_model_ids == set([self.conditions['tumor'][0], self.conditions['relapse'][0]])
+        df = model.gene_diff_df
+        assert isinstance(df, pd.DataFrame)
+        assert df.shape == (3, 14)
+        assert set(['tracking_id', 'gene_short_name', 'mean_1', 'mean_2', 'log2_fold_change']) <= set(df.columns)
+        assert df.set_index('gene_short_name').loc['TP53', 'q_value'] == 0.0187
+
+    def e_differential_expression_model_group_test(self):
+        # RNA-seq model groups hold no DE models, so the real query returns an empty DE group
+        group = self.model_group.get_differential_expression_models(self.model_group.model_id)
+        assert isinstance(group, DifferentialExpressionModelGroup)
+        assert len(group) == 0
+        tumor = self.conditions['tumor'][0]
+        relapse = self.conditions['relapse'][0]
+        pairs = {
+            'gmstk_test_de_in_group': '{0} tumor {1} relapse'.format(tumor, relapse),
+            'gmstk_test_de_other': '{0} tumor {1} relapse'.format('0' * 32, 'f' * 32),
+            'gmstk_test_de_no_pairs': None
+        }
+        for model_id, condition_pairs in pairs.items():
+            model = DifferentialExpressionModel(model_id, update_on_init=False)
+            if condition_pairs is not None:
+                model.condition_pairs = condition_pairs
+            group.models[model_id] = model
+        selected = group.select_input_models(self.model_group.model_labels)
+        assert selected is group
+        assert set(group.models) == set(['gmstk_test_de_in_group'])
+        assert group.models['gmstk_test_de_in_group'].input_model_ids == set([tumor, relapse])
@@ -0,0 +1,154 @@
+from gmstk import stats
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+
+class TestStats:
+
+    @classmethod
+    def setup_class(cls):
+        rng = np.random.RandomState(0)
+        cls.x_1 = rng.lognormal(2, 0.25, size=(500, 6))
+        cls.x_2 = rng.lognormal(2, 0.25, size=(500, 8))
+        cls.x_2[:50] *= 4
+
+    def a_fdr_correct_test(self):
+        q = stats.fdr_correct([0.01, 0.04, 0.03, np.nan, 0.2])
+        assert np.allclose(q[[0, 1, 2, 4]], [0.04, 0.16 / 3, 0.16 / 3, 0.2])
+        assert np.isnan(q[3])
+
+    def b_welch_t_matches_scalar_test_test(self):
+        from scipy.stats import ttest_ind
+        t, p = stats.welch_t(self.x_1, self.x_2)
+        expected = ttest_ind(self.x_2[7], self.x_1[7], equal_var=False)
+        assert np.isclose(t[7], expected.statistic)
+        assert np.isclose(p[7], expected.pvalue)
+
+    def c_differential_expression_test(self):
+        for test in stats.TESTS:
+            df = stats.differential_expression(self.x_1, self.x_2, test=test)
+            assert isinstance(df, pd.DataFrame)
+            assert df.shape[0] == 500
+            assert (df['log2_fold_change'][:50] > 0).all()
+            assert (df['q_value'][:50] < 0.05).mean() > 0.9
+            assert (df['q_value'][50:] < 0.05).mean() < 0.1
+
+    def d_constant_rows_test(self):
+        x_1 = np.array([[1.0, 1.0, 1.0], [2.0, 2.0, 2.0]])
+        x_2 = np.array([[1.0, 1.0, 1.0], [5.0, 5.0, 5.0]])
+        t, p = stats.welch_t(x_1, x_2)
+        assert t[0] == 0 and p[0] == 1
+        assert t[1] == np.inf and p[1] == 0
+        u, p = stats.rank_sum(x_1, x_2)
+        assert p[0] == 1
+        for test in stats.TESTS:
+            df = stats.differential_expression(x_1, x_2, test=test)
+            assert not df['q_value'].isnull().any()
+
+    def e_rank_sum_matches_scalar_test_test(self):
+        from scipy.stats import mannwhitneyu
+        x_1 = np.round(self.x_1, 0)
+        x_2 = np.round(self.x_2, 0)
+        u, p = stats.rank_sum(x_1, x_2)
+        expected = mannwhitneyu(x_2[3], x_1[3], alternative='two-sided', method='asymptotic')
+        assert np.isclose(u[3], expected.statistic)
+        assert np.isclose(p[3], expected.pvalue)
+
+    def f_rank_sum_signed_values_test(self):
+        from scipy.stats import mannwhitneyu
+        x_1 = np.array([[-0.0, 0.0, -2.5, 1.0, 3.0], [1, 2, 3, 4, 5]], dtype=float)
+        x_2 = np.array([[0.0, -2.5, -1.0, 2.0, 2.0], [6, 7, 8, 9, 10]], dtype=float)
+        u, p = stats.rank_sum(x_1, x_2)
+        for i in range(2):
+            expected = mannwhitneyu(x_2[i], x_1[i], alternative='two-sided', method='asymptotic')
+            assert np.isclose(u[i], expected.statistic)
+            assert np.isclose(p[i], expected.pvalue)
+        assert np.allclose(stats.rank_sum(x_1.astype(int), x_2.astype(int))[0], stats.rank_sum(np.trunc(x_1), np.trunc(x_2))[0])
+
+
+def summarize(chunk, index=None):
+    return stats.CohortSummary(chunk.shape[0], index=index).update(chunk)
+
+
+class TestCohortSummary:
+
+    @classmethod
+    def setup_class(cls):
+        rng = np.random.RandomState(1)
+        cls.x = rng.lognormal(2, 1, size=(200, 300))
+        cls.x[:20] = 0
+
+    def a_streaming_matches_in_memory_test(self):
+        summary = stats.CohortSummary(200)
+        for j in range(self.x.shape[1]):
+            summary.update(self.x[:, j])
+        assert summary.n == 300
+        assert np.allclose(summary.mean, self.x.mean(axis=1))
+        assert np.allclose(summary.variance[20:], self.x[20:].var(axis=1, ddof=1))
+        assert np.allclose(summary.min, self.x.min(axis=1))
+        assert np.allclose(summary.max, self.x.max(axis=1))
+        assert (summary.detected == (self.x > 1.0).sum(axis=1)).all()
+
+    def b_merge_chunks_test(self):
+        whole = stats.CohortSummary(200).update(self.x)
+        merged = stats.CohortSummary(200)
+        for chunk in (self.x[:, :10], self.x[:, 10:150], self.x[:, 150:]):
+            merged.merge(stats.CohortSummary(200).update(chunk))
+        assert merged.n == whole.n
+        assert np.allclose(merged.mean, whole.mean)
+        assert np.allclose(merged.variance, whole.variance)
+        assert (merged.detected == whole.detected).all()
+
+    def c_approximate_quantiles_test(self):
+        summary = stats.CohortSummary(200).update(self.x)
+        q = summary.quantile([0.5, 0.9])
+        expected = np.percentile(self.x, [50, 90], axis=1).T
+        assert np.allclose(q[20:], expected[20:], rtol=0.1)
+        assert (q[:20] == 0).all()
+
+    def d_top_variable_test(self):
+        index = ['gene{0}'.format(i) for i in range(200)]
+        summary = stats.CohortSummary(200, index=index).update(self.x)
+        top = summary.top_variable(5)
+        expected = np.argsort(-self.x.var(axis=1))[:5]
+        assert list(top.index) == [index[i] for i in expected]
+        df = summary.to_df()
+        assert df.shape == (200, 8)
+
+    def e_merge_checks_index_test(self):
+        index = np.array(['gene{0}'.format(i) for i in range(200)])
+        summary = summarize(self.x[:, :10], index)
+        try:
+            summary.merge(summarize(self.x[::-1, 10:], index[::-1]))
+        except ValueError:
+            pass
+        else:
+            assert False, 'Expected ValueError'
+        summary.merge(summarize(self.x[:, 10:], index))
+        assert summary.n == 300
+
+    def f_merge_across_processes_test(self):
+        index = np.array(['gene{0}'.format(i) for i in range(200)])
+        chunks = [self.x[:, i:i + 50] for i in range(0, 300, 50)]
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            partials = list(executor.map(summarize, chunks, [index] * len(chunks)))
+        merged = stats.CohortSummary(200, index=index)
+        for partial in partials:
+            merged.merge(partial)
+        whole = summarize(self.x, index)
+        assert merged.n == 300
+        assert np.allclose(merged.mean, whole.mean)
+        assert np.allclose(merged.variance, whole.variance)
+        assert (merged.quantile(0.5) == whole.quantile(0.5)).all()
+
+    def g_empty_summary_test(self):
+        index = np.array(['gene{0}'.format(i) for i in range(200)])
+        empty = stats.CohortSummary(200)
+        assert np.isnan(empty.variance).all()
+        assert np.isnan(summarize(self.x[:, :1]).variance).all()
+        empty.merge(stats.CohortSummary(200, index=index))
+        empty.merge(summarize(self.x, index))
+        assert np.array_equal(empty.index, index)
+        assert list(empty.to_df().index) == list(index)
+        assert np.allclose(empty.variance, self.x.var(axis=1, ddof=1))